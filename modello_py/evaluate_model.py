@@ -1,9 +1,6 @@
-import os
-import json
 import numpy as np
 import torch
-from torch.utils.data import Dataset, DataLoader
-from sklearn.metrics import accuracy_score, confusion_matrix, classification_report
+from sklearn.metrics import classification_report
 
 # Importa le classi del modello e del dataset dal tuo script di training
 from train_model import CNNLSTM, HandGestureDataset 
@@ -14,7 +11,7 @@ MODEL_WEIGHTS_PATH = 'tap_model_weights.pth' # File dei pesi salvato
 WINDOW_SIZE = 25
 NUM_FEATURES = 3
 NUM_CLASSES = 2
-BATCH_SIZE = 8
+DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 # --- 2. CARICAMENTO DATI E MODELLO ---
 print("Caricamento dati di test...")
@@ -22,46 +19,50 @@ test_dataset = HandGestureDataset(data_dir=TEST_DATA_DIR)
 if len(test_dataset) == 0:
     print(f"Errore: Nessun dato trovato nella cartella di test: {TEST_DATA_DIR}")
     exit()
-test_loader = DataLoader(dataset=test_dataset, batch_size=BATCH_SIZE, shuffle=False)
+# Il test set è piccolo: viene impilato per intero in un unico tensore direttamente dalla cache
+all_sequences = torch.from_numpy(np.array(test_dataset.features)).to(DEVICE)
+all_labels_t = test_dataset.labels_t
 
 print("Caricamento modello addestrato...")
 model = CNNLSTM(num_features=NUM_FEATURES, num_classes=NUM_CLASSES)
-model.load_state_dict(torch.load(MODEL_WEIGHTS_PATH))
+model.load_state_dict(torch.load(MODEL_WEIGHTS_PATH, map_location=DEVICE))
+model = model.to(DEVICE)
 model.eval() # Imposta il modello in modalità valutazione (molto importante!)
+# Nessuna compilazione JIT: la valutazione è un unico forward pass e il tempo di compilazione supererebbe il guadagno
 
 # --- 3. ESECUZIONE DELLA VALUTAZIONE ---
-all_labels = []
-all_predictions = []
-
 print("Esecuzione delle predizioni sul test set...")
-with torch.no_grad(): # Disabilita il calcolo dei gradienti per velocizzare
-    for sequences, labels in test_loader:
-        outputs = model(sequences)
-        # Ottieni le predizioni prendendo la classe con la probabilità più alta
-        _, predicted = torch.max(outputs.data, 1)
-        
-        all_labels.extend(labels.numpy())
-        all_predictions.extend(predicted.numpy())
+with torch.inference_mode(): # Disabilita il calcolo dei gradienti e il tracciamento autograd per velocizzare
+    # Un unico forward pass sull'intero test set
+    outputs = model(all_sequences)
+    # Ottieni le predizioni prendendo la classe con la probabilità più alta
+    predicted = outputs.argmax(1).cpu()
+
+# Matrice di confusione calcolata con un unico conteggio vettoriale (righe = verità, colonne = predizione)
+cm = torch.bincount(NUM_CLASSES * all_labels_t + predicted, minlength=NUM_CLASSES * NUM_CLASSES).reshape(NUM_CLASSES, NUM_CLASSES)
 
 # --- 4. CALCOLO E STAMPA DELLE METRICHE ---
-# Converte le etichette numeriche in nomi per una migliore leggibilità
+# Nomi delle classi, usati solo per la stampa: le metriche lavorano direttamente sulle etichette numeriche
 class_names = ['sfondo', 'tap']
-all_labels_named = [class_names[i] for i in all_labels]
-all_predictions_named = [class_names[i] for i in all_predictions]
+class_indices = list(range(len(class_names)))
 
-# Accuratezza
-accuracy = accuracy_score(all_labels, all_predictions)
+# Accuratezza, precisione e richiamo ricavati direttamente dalla matrice di confusione
+accuracy = (cm.diag().sum() / cm.sum()).item()
+tp, fp, fn = cm[1, 1].item(), cm[0, 1].item(), cm[1, 0].item()
+precision = tp / (tp + fp) if tp + fp > 0 else 0.0
+recall = tp / (tp + fn) if tp + fn > 0 else 0.0
 print("\n--- Risultati della Valutazione ---")
 print(f"✅ Accuratezza Totale: {accuracy * 100:.2f}%")
+print(f"Precisione ({class_names[1]}): {precision * 100:.2f}% | Richiamo ({class_names[1]}): {recall * 100:.2f}%")
 
 # Matrice di Confusione
 print("\n🌀 Matrice di Confusione:")
 print("Indica quanti campioni di una classe sono stati classificati come un'altra.")
 print("Righe = Verità | Colonne = Predizione")
-cm = confusion_matrix(all_labels_named, all_predictions_named, labels=class_names)
-print(cm)
+print(cm.numpy())
 
 # Report di Classificazione
 print("\n📊 Report di Classificazione Dettagliato:")
-report = classification_report(all_labels_named, all_predictions_named, target_names=class_names)
+# sklearn viene usato solo per la formattazione del report, con etichette numeriche
+report = classification_report(all_labels_t.numpy(), predicted.numpy(), labels=class_indices, target_names=class_names)
 print(report)
\ No newline at end of file
@@ -1,10 +1,12 @@
 import os
-import json
+import orjson
 import numpy as np
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
+import torch.nn.functional as F
+from torch.utils.data import Dataset, DataLoader, random_split
 import coremltools as ct
+from coremltools.models.neural_network import quantization_utils
 
 # --- 1. CONFIGURAZIONE ---
 # Definizione dei parametri fondamentali per l'addestramento e la struttura del modello
@@ -13,68 +15,206 @@ WINDOW_SIZE = 25                    # Numero di campioni per ogni sequenza tempo
 NUM_FEATURES = 3                    # Numero di caratteristiche per ogni campione (velocità, accelerazione, ratio)
 NUM_CLASSES = 2                     # Numero di classi da classificare (sfondo, tap)
 BATCH_SIZE = 16                     # Dimensione del batch per l'addestramento
-NUM_EPOCHS = 500                    # Numero di iterazioni complete sul dataset
+NUM_EPOCHS = 500                    # Numero massimo di iterazioni complete sul dataset
+VALIDATION_SPLIT = 0.2              # Frazione del dataset riservata alla validazione
+PATIENCE = 20                       # Epoche senza miglioramento della loss di validazione prima di fermarsi
 LEARNING_RATE = 0.0001              # Tasso di apprendimento
+MAX_INFERENCE_BATCH = 64            # Numero massimo di finestre valutabili insieme dal modello Core ML
+DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')  # Dispositivo usato per l'addestramento
+# Precisione mista BF16 (opzionale, disattivata di default): per questo modello piccolo il costo delle conversioni
+# supera il guadagno anche su CPU con AVX512-BF16/AMX. Attivarla solo dopo averla misurata sull'hardware in uso.
+ENABLE_BF16 = False
+# Su GPU BF16 è supportato solo da Ampere in poi; su CPU senza supporto hardware verrebbe emulato
+USE_BF16 = ENABLE_BF16 and (DEVICE.type == 'cpu' or torch.cuda.is_bf16_supported())
+LABEL_MAP = {'sfondo': 0, 'tap': 1} # Mappa che associa le classi agli indici numerici
+CACHE_FILENAME = 'features_cache.dat'  # Cache memory-mapped delle caratteristiche (nella cartella del dataset)
+LABELS_FILENAME = 'labels.npy'         # Etichette affiancate alla cache
+MANIFEST_FILENAME = 'cache_manifest.json'  # Elenco dei file sorgente usati per costruire la cache
 
 # --- 2. CLASSE PER CARICARE IL DATASET ---
+def load_features(file_path):
+    """
+    Legge un file JSON e restituisce l'array delle caratteristiche (NUM_FEATURES, WINDOW_SIZE),
+    oppure None se il file non è valido.
+    """
+    # orjson lavora su bytes: il file viene aperto in modalità binaria
+    with open(file_path, 'rb') as f:
+        try:
+            data = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            # Gestione degli errori di decodifica JSON
+            print(f"Errore nel leggere il file JSON: {file_path}")
+            return None
+
+    # Verifica della forma corretta dei dati
+    if len(data) != WINDOW_SIZE:
+         print(f"Attenzione: Il file {file_path} ha una finestra di {len(data)} campioni invece di {WINDOW_SIZE}. Verrà saltato.")
+         return None
+
+    # Estrazione delle caratteristiche dai dati JSON in un unico passaggio su un array preallocato
+    arr = np.empty((WINDOW_SIZE, NUM_FEATURES), dtype=np.float32)
+    try:
+        for i, item in enumerate(data):
+            arr[i, 0] = item.get('relativeYVelocity', 0.0)      # Velocità relativa verticale
+            arr[i, 1] = item.get('relativeYAcceleration', 0.0)  # Accelerazione relativa verticale
+            arr[i, 2] = item.get('stabilityRatio', 0.0)         # Rapporto di stabilità
+    except (TypeError, ValueError, AttributeError):
+        # Campioni non numerici o malformati: il file viene scartato come gli altri file non validi
+        print(f"Attenzione: Il file {file_path} contiene valori non numerici. Verrà saltato.")
+        return None
+
+    # I valori null vengono convertiti in NaN: il file viene scartato invece di propagare NaN nel training
+    if not np.isfinite(arr).all():
+        print(f"Attenzione: Il file {file_path} contiene valori mancanti o non finiti. Verrà saltato.")
+        return None
+
+    # Organizzazione delle caratteristiche nella forma (NUM_FEATURES, WINDOW_SIZE)
+    features = arr.T
+    return features
+
+def _list_data_files(data_dir, verbose=False):
+    # Raccolta di tutti i file JSON da ogni cartella di classe, con la relativa etichetta
+    data_files = []
+    labels = []
+    for label_name, label_idx in LABEL_MAP.items():
+        class_dir = os.path.join(data_dir, label_name)
+        if not os.path.isdir(class_dir):
+            if verbose:
+                print(f"Attenzione: La cartella {class_dir} non esiste.")
+            continue
+        for filename in sorted(os.listdir(class_dir)):
+            if filename.endswith('.json'):
+                data_files.append(os.path.join(class_dir, filename))
+                labels.append(label_idx)
+    return data_files, labels
+
+def _build_manifest(data_files):
+    # Elenco di (percorso, dimensione, mtime) dei file sorgente: qualsiasi aggiunta, rimozione
+    # o modifica di un file produce un manifest diverso e invalida la cache
+    manifest = []
+    for file_path in data_files:
+        st = os.stat(file_path)
+        manifest.append([file_path, st.st_size, st.st_mtime_ns])
+    return manifest
+
+def build_cache(data_dir, cache_path):
+    """
+    Decodifica una sola volta tutti i file JSON del dataset e li scrive in un file memory-mapped
+    di forma (N, NUM_FEATURES, WINDOW_SIZE), con le etichette salvate in un file .npy affiancato.
+    Restituisce il numero di campioni validi.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    labels_path = os.path.join(cache_dir, LABELS_FILENAME)
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    data_files, labels = _list_data_files(data_dir, verbose=True)
+
+    if not data_files:
+        # Nessun file sorgente: una cache precedente non è più valida e va rimossa
+        for path in (cache_path, labels_path, manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return 0
+
+    # Scrittura dei campioni validi in un file memory-mapped preallocato:
+    # i file non validi vengono scartati qui, una volta per tutte
+    mm = np.memmap(cache_path, dtype='float32', mode='w+', shape=(len(data_files), NUM_FEATURES, WINDOW_SIZE))
+    valid_labels = []
+    for file_path, label_idx in zip(data_files, labels):
+        features = load_features(file_path)
+        if features is None:
+            continue
+        mm[len(valid_labels)] = features
+        valid_labels.append(label_idx)
+    mm.flush()
+    del mm
+
+    skipped = len(data_files) - len(valid_labels)
+    if skipped:
+        print(f"Attenzione: {skipped} file non validi su {len(data_files)} sono stati esclusi dalla cache.")
+
+    # Il numero di etichette determina quanti campioni validi leggere dalla cache
+    np.save(labels_path, np.array(valid_labels, dtype=np.int64))
+    # Il manifest viene scritto per ultimo: una cache interrotta a metà risulta sempre non valida
+    with open(manifest_path, 'wb') as f:
+        f.write(orjson.dumps(_build_manifest(data_files)))
+    return len(valid_labels)
+
+def _cache_is_stale(data_dir, cache_path):
+    # La cache va ricostruita se manca o se i file sorgente non corrispondono più al manifest salvato
+    cache_dir = os.path.dirname(cache_path)
+    labels_path = os.path.join(cache_dir, LABELS_FILENAME)
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    if not all(os.path.exists(path) for path in (cache_path, labels_path, manifest_path)):
+        return True
+    with open(manifest_path, 'rb') as f:
+        try:
+            saved_manifest = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            return True
+    data_files, _ = _list_data_files(data_dir)
+    return saved_manifest != _build_manifest(data_files)
+
 class HandGestureDataset(Dataset):
     """
     Classe personalizzata per caricare e preprocessare i dati dei gesti delle mani.
     Estende la classe Dataset di PyTorch per permettere l'uso del DataLoader.
     """
     def __init__(self, data_dir):
-        # Inizializzazione delle liste per file di dati ed etichette
-        self.data_files = []
-        self.labels = []
         # Mappa che associa le classi agli indici numerici
-        self.label_map = {'sfondo': 0, 'tap': 1}
+        self.label_map = LABEL_MAP
+        cache_path = os.path.join(data_dir, CACHE_FILENAME)
+        labels_path = os.path.join(data_dir, LABELS_FILENAME)
 
-        # Caricamento dei dati da ogni cartella di classe
-        for label_name, label_idx in self.label_map.items():
-            class_dir = os.path.join(data_dir, label_name)
-            if not os.path.isdir(class_dir):
-                print(f"Attenzione: La cartella {class_dir} non esiste.")
-                continue
-            # Raccolta di tutti i file JSON nella cartella della classe
-            for filename in os.listdir(class_dir):
-                if filename.endswith('.json'):
-                    self.data_files.append(os.path.join(class_dir, filename))
-                    self.labels.append(label_idx)
+        # Costruzione della cache alla prima esecuzione (o se il dataset è cambiato)
+        if os.path.isdir(data_dir) and _cache_is_stale(data_dir, cache_path):
+            print(f"Creazione della cache del dataset in {cache_path}...")
+            build_cache(data_dir, cache_path)
+
+        if not os.path.exists(cache_path) or not os.path.exists(labels_path):
+            # Nessun dato disponibile: dataset vuoto
+            print(f"Attenzione: Nessun campione trovato in {data_dir}.")
+            self.labels = np.empty(0, dtype=np.int64)
+            self.features = np.empty((0, NUM_FEATURES, WINDOW_SIZE), dtype=np.float32)
+        else:
+            # Apertura della cache in sola lettura: nessuna decodifica, le pagine restano nella cache del sistema operativo
+            self.labels = np.load(labels_path)
+            self.features = np.memmap(cache_path, dtype='float32', mode='r',
+                                      shape=(len(self.labels), NUM_FEATURES, WINDOW_SIZE))
+        self.labels_t = torch.from_numpy(self.labels)
 
     def __len__(self):
         # Restituisce il numero totale di campioni nel dataset
-        return len(self.data_files)
+        return len(self.labels)
 
     def __getitem__(self, idx):
-        # Carica un singolo campione in base all'indice
-        file_path = self.data_files[idx]
-        with open(file_path, 'r') as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                # Gestione degli errori di decodifica JSON
-                print(f"Errore nel leggere il file JSON: {file_path}")
-                return torch.zeros(NUM_FEATURES, WINDOW_SIZE), torch.tensor(0, dtype=torch.long)
-
-        # Estrazione delle caratteristiche dai dati JSON
-        velocity = [item.get('relativeYVelocity', 0.0) for item in data]          # Velocità relativa verticale
-        acceleration = [item.get('relativeYAcceleration', 0.0) for item in data]  # Accelerazione relativa verticale
-        velocity_ratio = [item.get('stabilityRatio', 0.0) for item in data]       # Rapporto di stabilità
-        
-        # Organizzazione delle caratteristiche in un array 
-        features = np.array([velocity, acceleration, velocity_ratio], dtype=np.float32)
-        
-        # Verifica della forma corretta dei dati
-        if features.shape != (NUM_FEATURES, WINDOW_SIZE):
-             print(f"Attenzione: Il file {file_path} ha una forma errata {features.shape}. Verrà saltato.")
-             # Passa al campione successivo in caso di forma errata
-             return self.__getitem__((idx + 1) % len(self))
-
-        # Conversione in tensori PyTorch
-        features_tensor = torch.from_numpy(features)
-        label_tensor = torch.tensor(self.labels[idx], dtype=torch.long)
-        
-        return features_tensor, label_tensor
+        # Restituisce una copia del campione letto dalla cache: nessun accesso ai file JSON
+        return torch.from_numpy(np.array(self.features[idx])), self.labels_t[idx]
+
+class DeviceBatchLoader:
+    """
+    Sostituto minimo del DataLoader per tensori già residenti sul dispositivo:
+    i batch sono ottenuti per indicizzazione, senza collate né copie host -> dispositivo.
+    """
+    def __init__(self, features, labels, batch_size, shuffle=False, drop_last=False):
+        self.features = features
+        self.labels = labels
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __len__(self):
+        # Numero di batch per epoca, con la stessa semantica del DataLoader
+        if self.drop_last:
+            return len(self.labels) // self.batch_size
+        return (len(self.labels) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        n = len(self.labels)
+        device = self.labels.device
+        order = torch.randperm(n, device=device) if self.shuffle else torch.arange(n, device=device)
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            idx = order[start:start + self.batch_size]
+            yield self.features[idx], self.labels[idx]
 
 # --- 3. DEFINIZIONE DEL MODELLO CNN-LSTM ---
 class CNNLSTM(nn.Module):
@@ -86,24 +226,23 @@ class CNNLSTM(nn.Module):
         super(CNNLSTM, self).__init__()
         
         # Layer CNN per l'estrazione delle caratteristiche
-        self.conv1 = nn.Conv1d(in_channels=num_features, out_channels=32, kernel_size=3, padding=1)
-        self.relu = nn.ReLU()  # Funzione di attivazione non lineare
-        self.pool = nn.MaxPool1d(kernel_size=2)  # Riduce la dimensionalità e aiuta a evitare l'overfitting
+        # Lo stride 2 sostituisce il max pooling: dimezza la sequenza (25 -> 12) in un'unica operazione
+        self.conv1 = nn.Conv1d(in_channels=num_features, out_channels=32, kernel_size=4, stride=2, padding=1)
         
         lstm_input_size = 32  # Dimensione di input per LSTM (corrisponde a out_channels della CNN)
         # Layer LSTM per catturare le dipendenze temporali
+        # (nn.LSTM resta preferibile a nn.GRU: Core ML lo converte in un unico layer nativo uniDirectionalLSTM,
+        # mentre la GRU diventa un loop con un layer per ogni passo temporale, più lento sul dispositivo)
         self.lstm = nn.LSTM(input_size=lstm_input_size, hidden_size=lstm_hidden_size, batch_first=True)
         # Fully connected layer per la classificazione finale
         self.fc = nn.Linear(lstm_hidden_size, num_classes)
 
     def forward(self, x):
         # Passaggio attraverso la CNN
-        x = self.conv1(x)  # Applica convoluzione 1D
-        x = self.relu(x)   # Applica funzione di attivazione
-        x = self.pool(x)   # Applica max pooling
+        x = F.relu_(self.conv1(x))  # Applica convoluzione 1D con stride e attivazione in-place
         
         # Riorganizzazione del tensore per l'input LSTM (batch, seq_len, features)
-        x = x.permute(0, 2, 1) 
+        x = x.permute(0, 2, 1).contiguous()
         
         # Passaggio attraverso LSTM
         lstm_out, _ = self.lstm(x)
@@ -117,51 +256,146 @@ class CNNLSTM(nn.Module):
 # --- 4. TRAINING LOOP ---
 print("Caricamento dati...")
 # Inizializzazione del dataset di addestramento
-train_dataset = HandGestureDataset(data_dir=DATA_DIR)
-if len(train_dataset) == 0:
+full_dataset = HandGestureDataset(data_dir=DATA_DIR)
+if len(full_dataset) == 0:
     print("Errore: Nessun dato trovato nella cartella di training. Controlla il percorso e la struttura delle cartelle.")
     exit()
 
-# Creazione del DataLoader per l'addestramento batch per batch
-train_loader = DataLoader(dataset=train_dataset, batch_size=BATCH_SIZE, shuffle=True, drop_last=True)
+# Suddivisione in training e validazione (con seme fisso per avere sempre la stessa suddivisione)
+val_size = int(len(full_dataset) * VALIDATION_SPLIT)
+train_dataset, val_dataset = random_split(full_dataset, [len(full_dataset) - val_size, val_size],
+                                          generator=torch.Generator().manual_seed(42))
+if val_size == 0:
+    print("Attenzione: Dataset troppo piccolo per la validazione, early stopping disattivato.")
+
+# Creazione dei loader per l'addestramento batch per batch
+if DEVICE.type == 'cuda':
+    # Il dataset è piccolo (meno di 1 MB): viene copiato una sola volta sulla GPU
+    # e i batch vengono estratti per indicizzazione, senza copie a ogni passo
+    all_features = torch.from_numpy(np.array(full_dataset.features)).to(DEVICE)
+    all_labels = full_dataset.labels_t.to(DEVICE)
+    train_idx = torch.tensor(train_dataset.indices, dtype=torch.long, device=DEVICE)
+    val_idx = torch.tensor(val_dataset.indices, dtype=torch.long, device=DEVICE)
+    train_loader = DeviceBatchLoader(all_features[train_idx], all_labels[train_idx], BATCH_SIZE, shuffle=True, drop_last=True)
+    val_loader = DeviceBatchLoader(all_features[val_idx], all_labels[val_idx], BATCH_SIZE)
+else:
+    # Il dataset è già decodificato nella cache memory-mapped: l'indicizzazione nel processo principale
+    # è più veloce di qualsiasi worker, quindi non si usano processi aggiuntivi
+    train_loader = DataLoader(dataset=train_dataset, batch_size=BATCH_SIZE, shuffle=True, drop_last=True, num_workers=0)
+    val_loader = DataLoader(dataset=val_dataset, batch_size=BATCH_SIZE, shuffle=False, num_workers=0)
 
 print("Inizializzazione modello...")
 # Creazione del modello, funzione di perdita e ottimizzatore
-model = CNNLSTM(num_features=NUM_FEATURES, num_classes=NUM_CLASSES)
+model = CNNLSTM(num_features=NUM_FEATURES, num_classes=NUM_CLASSES).to(DEVICE)
+# Compilazione JIT del modello solo su GPU, dove i CUDA graph di "reduce-overhead" riducono l'overhead per operazione:
+# su CPU il modello compilato non è più veloce e il tempo di compilazione pesa su ogni esecuzione
+if DEVICE.type == 'cuda':
+    train_forward = torch.compile(model, mode="reduce-overhead")
+else:
+    train_forward = model
 criterion = nn.CrossEntropyLoss()  # Funzione di perdita standard per classificazione
-optimizer = torch.optim.Adam(model.parameters(), lr=LEARNING_RATE)  # Ottimizzatore Adam
+optimizer = torch.optim.Adam(model.parameters(), lr=LEARNING_RATE, fused=True)  # Ottimizzatore Adam (aggiornamento fuso in un unico kernel)
 
 print("Inizio training...")
+best_val_loss = float('inf')
+best_state = None
+epochs_without_improvement = 0
+
 # Loop principale di addestramento
 for epoch in range(NUM_EPOCHS):
+    model.train()
+    # La loss viene accumulata come tensore: un solo .item() (sincronizzazione) per epoca
+    running_loss = torch.zeros((), device=DEVICE)
     for i, (sequences, labels) in enumerate(train_loader):
-        # Forward pass: calcolo delle previsioni
-        outputs = model(sequences)
-        # Calcolo della perdita
-        loss = criterion(outputs, labels)
+        # Copia dei dati sul dispositivo (nessuna operazione se sono già residenti sulla GPU)
+        sequences = sequences.to(DEVICE, non_blocking=True)
+        labels = labels.to(DEVICE, non_blocking=True)
+
+        # Forward pass, in precisione mista BF16 solo se abilitata con ENABLE_BF16
+        # (nessun GradScaler necessario con BF16; l'ottimizzatore resta in FP32)
+        with torch.autocast(device_type=DEVICE.type, dtype=torch.bfloat16, enabled=USE_BF16):
+            # Calcolo delle previsioni
+            outputs = train_forward(sequences)
+            # Calcolo della perdita
+            loss = criterion(outputs, labels)
         
         # Backward pass e ottimizzazione
         optimizer.zero_grad()  # Azzera i gradienti per la nuova iterazione
         loss.backward()        # Calcola i gradienti
         optimizer.step()       # Aggiorna i pesi del modello
-        
+
+        running_loss += loss.detach()
+
+    train_loss = running_loss.item() / max(len(train_loader), 1)
+
+    # Senza set di validazione non c'è early stopping: si addestra per tutte le epoche
+    if val_size == 0:
+        print(f'Epoch [{epoch+1}/{NUM_EPOCHS}], Loss: {train_loss:.4f}')
+        continue
+
+    # Calcolo della loss di validazione
+    model.eval()
+    val_loss = torch.zeros((), device=DEVICE)
+    with torch.inference_mode():
+        for sequences, labels in val_loader:
+            sequences = sequences.to(DEVICE, non_blocking=True)
+            labels = labels.to(DEVICE, non_blocking=True)
+            val_loss += criterion(train_forward(sequences), labels) * labels.size(0)
+    val_loss = val_loss.item() / val_size
+
     # Stampa dei progressi dopo ogni epoca
-    print(f'Epoch [{epoch+1}/{NUM_EPOCHS}], Loss: {loss.item():.4f}')
+    print(f'Epoch [{epoch+1}/{NUM_EPOCHS}], Loss: {train_loss:.4f}, Val Loss: {val_loss:.4f}')
+
+    # Early stopping: si conservano i pesi migliori e ci si ferma se la validazione non migliora più
+    if val_loss < best_val_loss:
+        best_val_loss = val_loss
+        best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        epochs_without_improvement = 0
+    else:
+        epochs_without_improvement += 1
+        if epochs_without_improvement >= PATIENCE:
+            print(f"Early stopping: nessun miglioramento della loss di validazione da {PATIENCE} epoche.")
+            break
+
+# Ripristino dei pesi con la migliore loss di validazione
+if best_state is not None:
+    model.load_state_dict(best_state)
 
 print("Training completato!")
 
 # Salvataggio dei pesi del modello in formato PyTorch
+# (si usa il modulo originale, mai quello compilato, per evitare il prefisso "_orig_mod." nelle chiavi dei pesi)
 torch.save(model.state_dict(), "tap_model_weights.pth")
 print("Pesi del modello PyTorch salvati in tap_model_weights.pth")
 
 # --- 5. CONVERSIONE IN CORE ML (METODO CORRETTO E SEMPLIFICATO) ---
+# Nome dell'output delle probabilità letto dall'app iOS (HandDetectionViewController.swift).
+# Il nome generato automaticamente dal convertitore cambia con l'architettura del modello,
+# quindi dopo ogni conversione l'output viene rinominato esplicitamente.
+PROBABILITY_OUTPUT_NAME = 'var_69'
+
+def rename_probability_output(mlmodel, new_name):
+    """
+    Rinomina l'output delle probabilità di un classificatore Core ML e restituisce il modello aggiornato.
+    """
+    spec = mlmodel.get_spec()
+    current_name = spec.description.predictedProbabilitiesName
+    if current_name == new_name:
+        return mlmodel
+    ct.utils.rename_feature(spec, current_name, new_name)
+    # I pesi di un ML Program sono salvati fuori dalla specifica e vanno passati esplicitamente
+    return ct.models.MLModel(spec, weights_dir=mlmodel.weights_dir)
+
 print("Conversione del modello in Core ML...")
 # Imposta il modello in modalità valutazione (disattiva dropout, etc.)
+# e lo riporta su CPU, dove avviene il tracciamento
 model.eval() 
+model = model.to('cpu')
 
 # Crea un input fittizio per tracciare il modello
-dummy_input = torch.rand(1, NUM_FEATURES, WINDOW_SIZE) 
-# Crea una versione tracciata del modello (più ottimizzata)
+# (batch > 1 per verificare che il tracciamento non dipenda dalla dimensione del batch)
+dummy_input = torch.rand(2, NUM_FEATURES, WINDOW_SIZE) 
+# Crea una versione tracciata del modello originale (non compilato)
 traced_model = torch.jit.trace(model, dummy_input)
 
 # 1. Definisci le etichette delle classi per il modello Core ML
@@ -174,10 +408,16 @@ classifier_config = ct.ClassifierConfig(class_labels)
 # CoreMLTools aggiungerà automaticamente un layer Softmax e configurerà gli output
 mlmodel = ct.convert(
     traced_model,
-    inputs=[ct.TensorType(name="input_1", shape=dummy_input.shape)],
+    # Dimensione del batch flessibile (default 1): permette di valutare più finestre in una sola predizione
+    inputs=[ct.TensorType(name="input_1", shape=ct.Shape(shape=(ct.RangeDim(lower_bound=1, upper_bound=MAX_INFERENCE_BATCH, default=1),
+                                                                NUM_FEATURES, WINDOW_SIZE)))],
     classifier_config=classifier_config,
     convert_to="neuralnetwork"  # Usa il formato neural network invece di ML Program
 )
+mlmodel = rename_probability_output(mlmodel, PROBABILITY_OUTPUT_NAME)
+
+# 4. Quantizzazione dei pesi a FP16: dimezza la dimensione del modello e la banda di memoria sul dispositivo
+mlmodel = quantization_utils.quantize_weights(mlmodel, nbits=16)
 
 # Salvataggio del modello Core ML
 mlmodel.save("TapDetector.mlmodel")
@@ -186,4 +426,25 @@ mlmodel.save("TapDetector.mlmodel")
 print("\nModello salvato come TapDetector.mlmodel!")
 print("Input atteso:", mlmodel.get_spec().description.input[0].name)
 print("Output di probabilità:", mlmodel.get_spec().description.predictedProbabilitiesName)
-print("Output etichetta:", mlmodel.get_spec().description.predictedFeatureName)
\ No newline at end of file
+print("Output etichetta:", mlmodel.get_spec().description.predictedFeatureName)
+
+# --- 6. ESPORTAZIONE AOT CON TORCH.EXPORT (ML PROGRAM) ---
+# TorchScript non è più sviluppato attivamente: torch.export cattura il grafo in anticipo con forma statica
+# (batch = 1, NUM_FEATURES x WINDOW_SIZE) e il formato ML Program salva i pesi in FP16.
+# Il file .mlmodel sopra resta quello usato dall'app; questo pacchetto è pronto per la migrazione a ML Program.
+print("\nEsportazione AOT del modello con torch.export...")
+export_input = torch.rand(1, NUM_FEATURES, WINDOW_SIZE)
+# run_decompositions({}) scompone gli operatori composti in operazioni supportate da coremltools
+exported_program = torch.export.export(model, (export_input,)).run_decompositions({})
+
+mlprogram = ct.convert(
+    exported_program,
+    inputs=[ct.TensorType(name="input_1", shape=export_input.shape)],
+    # Nuova configurazione: ct.convert registra nella precedente il nome dell'output generato
+    classifier_config=ct.ClassifierConfig(class_labels),
+    convert_to="mlprogram",
+    compute_precision=ct.precision.FLOAT16
+)
+mlprogram = rename_probability_output(mlprogram, PROBABILITY_OUTPUT_NAME)
+mlprogram.save("TapDetector.mlpackage")
+print("Modello ML Program salvato come TapDetector.mlpackage!")
\ No newline at end of file